@@ -1,11 +1,55 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import os
+import atexit
 import datetime
-import re # Import regular expressions for parsing duration
+import functools
+import heapq
+import json
+import logging
+import time
+import re
+import sys
+import tempfile
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import attrgetter
+from typing import NamedTuple
+
+try:
+    import orjson # Faster JSON decoding; optional, falls back to the stdlib parser
+except ImportError:
+    orjson = None
 
 # --- Configuration ---
 AMADEUS_CLIENT_ID = os.environ.get("amadeus-api-key", "YOUR_AMADEUS_CLIENT_ID")
 AMADEUS_CLIENT_SECRET = os.environ.get("amadeus-api-secret", "YOUR_AMADEUS_CLIENT_SECRET")
+LOG_LEVEL = os.environ.get("log_level", "WARNING").upper() # Progress messages are logged at INFO
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache")
+IATA_CODE_RE = re.compile(r"[A-Z]{3}") # Airport and city codes are exactly three letters
+DURATION_RE = re.compile(r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:\d+S)?)?$") # ISO 8601 durations as used by Amadeus, e.g. PT8H30M
+CONNECTION_TEXT = ("Direct", "1 connection", "2 connections", "3 connections", "4 connections") # Labels by connection count
+
+logger = logging.getLogger("plane-tickets")
+
+class BoundedRetry(Retry):
+    """A urllib3 Retry that honours Retry-After, but never waits longer than MAX_RETRY_AFTER seconds for it."""
+    MAX_RETRY_AFTER = 5
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, self.MAX_RETRY_AFTER)
+
+class FlightFinderUnauthorized(Exception):
+    """Raised when a FlightFinder cannot obtain an Amadeus access token, so no search can run."""
+
+class LiveOffer(NamedTuple):
+    """A flight offer flattened once so comparisons run on native values instead of nested dicts."""
+    price: float
+    connections: int # Most connections on any itinerary of the offer
+    raw: dict
 
 class FlightFinder:
     """
@@ -16,44 +60,257 @@ class FlightFinder:
     FLIGHT_DATES_URL = "https://test.api.amadeus.com/v1/shopping/flight-dates"
     FLIGHT_OFFERS_URL = "https://test.api.amadeus.com/v2/shopping/flight-offers"
     AIRLINES_URL = "https://test.api.amadeus.com/v1/reference-data/airlines"
+    REQUEST_TIMEOUT = (3, 10) # (connect, read) seconds before a stalled Amadeus call is abandoned
+    MAX_PARALLEL_REQUESTS = 6 # Upper bound on concurrent live-offer lookups (Amadeus rate limits)
+    TOKEN_CACHE_FILE = os.path.join(CACHE_DIR, "amadeus_token.json")
+    TOKEN_EXPIRY_MARGIN = 60 # Refresh cached tokens this many seconds before they expire
+    AIRLINE_CACHE_FILE = os.path.join(CACHE_DIR, "amadeus_airlines.json")
+    AIRLINE_CACHE_TTL = 7 * 24 * 3600 # Airline names practically never change, so each is refetched weekly
+    OFFER_CACHE_FILE = os.path.join(CACHE_DIR, "amadeus_offers.json")
+    OFFER_CACHE_TTL = 300 # Live prices move on minute-to-hour timescales
+    OFFER_CACHE_MAXSIZE = 1024 # Entries kept on disk; the soonest-expiring are evicted first
+    # Query parameters shared by every live-offer request.
+    # "maxNumberOfConnections" doesn't work with the Amadeus API, so connections are filtered client-side.
+    # Fetch enough offers that the cheapest one within the connection limit is still among them.
+    OFFER_PARAMS_BASE = types.MappingProxyType({"adults": 1, "max": 50})
 
     def __init__(self, client_id, client_secret):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.session = self._create_session()
+        self._token_lock = threading.Lock()
         self.token = self._get_token()
-        self.airline_cache = {} # Cache for airline names
+        if not self.token:
+            raise FlightFinderUnauthorized("Could not obtain an Amadeus access token.")
+        self.session.headers.update({"Authorization": f"Bearer {self.token}"})
+        cached_airlines = self._load_airline_cache()
+        self.airline_cache = {code: name for code, (name, _) in cached_airlines.items()} # Persisted across runs
+        self._airline_fetched_at = {code: fetched_at for code, (_, fetched_at) in cached_airlines.items()}
+        self._airline_cache_dirty = False
+        atexit.register(self._save_airline_cache) # Flush new names once at exit instead of on every lookup
+        self.offer_cache = self._load_offer_cache() # "origin|destination|departure|return|max connections" -> [expires_at, raw offer]
+        self._offer_cache_dirty = False
+        atexit.register(self._save_offer_cache)
+        self._connection_limited_dates = set() # Dates whose offers all exceeded max_connections in the current search
+
+    def _create_session(self):
+        """Creates a pooled HTTP session so every call reuses a warm TLS connection to Amadeus."""
+        session = requests.Session()
+        # Retry rate limits and transient gateway errors with exponential backoff rather than losing a date's results.
+        # Connect/read retries and every sleep are capped so one stalled date can't hold a pool worker for long.
+        retries = BoundedRetry(
+            total=5,
+            connect=2,
+            read=1,
+            backoff_factor=0.5,
+            backoff_max=4,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+        )
+        # Every call goes to one host, so a single pool sized to the step-2 fan-out lets each worker keep a warm connection
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.MAX_PARALLEL_REQUESTS, max_retries=retries)
+        session.mount("https://", adapter)
+        return session
 
     def _get_token(self):
         """Retrieves an OAuth2 token from the Amadeus API."""
         if not self.client_id or not self.client_secret or self.client_id == "YOUR_AMADEUS_CLIENT_ID":
-            print("❌ ERROR: Amadeus credentials are not set.")
+            logger.error("❌ ERROR: Amadeus credentials are not set.")
             return None
         
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        cached_token = self._load_cached_token()
+        if cached_token:
+            logger.info("✅ Reusing cached access token.")
+            return cached_token
+
+        return self._request_token()
+
+    def _request_token(self):
+        """Requests a new OAuth2 token from the Amadeus API and caches it on disk."""
         body = { "grant_type": "client_credentials", "client_id": self.client_id, "client_secret": self.client_secret }
         try:
-            response = requests.post(self.TOKEN_URL, headers=headers, data=body)
+            # Never send a (possibly rejected) bearer token along with the credentials
+            response = self.session.post(self.TOKEN_URL, data=body, headers={"Authorization": None}, timeout=self.REQUEST_TIMEOUT)
             response.raise_for_status()
-            print("✅ Access token retrieved successfully.")
-            return response.json().get("access_token")
+            logger.info("✅ Access token retrieved successfully.")
+            token_data = self._decode_json(response)
+            self._save_cached_token(token_data)
+            return token_data.get("access_token")
         except requests.exceptions.RequestException as e:
-            print(f"❌ Failed to get Amadeus token: {e}")
+            logger.error(f"❌ Failed to get Amadeus token: {e}")
             return None
 
+    def _refresh_token(self, rejected_token):
+        """Replaces a token Amadeus rejected (revoked, or the secret was rotated). Returns True if a usable token is set."""
+        with self._token_lock:
+            if self.token != rejected_token:
+                return True # Another worker already refreshed it
+
+            logger.warning("⚠️  Access token was rejected; requesting a new one.")
+            self._invalidate_cached_token()
+            token = self._request_token()
+            if not token:
+                return False
+            self.token = token
+            self.session.headers.update({"Authorization": f"Bearer {token}"})
+            return True
+
+    def _api_get(self, url, params):
+        """GETs an Amadeus endpoint, refreshing the token and retrying once if the current one is rejected."""
+        token = self.token
+        response = self.session.get(url, params=params, timeout=self.REQUEST_TIMEOUT)
+        if response.status_code == 401 and self._refresh_token(token):
+            response = self.session.get(url, params=params, timeout=self.REQUEST_TIMEOUT)
+        return response
+
+    def _decode_json(self, response):
+        """Parses a response body with orjson, surfacing malformed JSON as a requests error like response.json() does."""
+        if orjson is None:
+            return response.json()
+        try:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError as e:
+            raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos) from e
+
+    def _write_cache_file(self, path, data):
+        """Atomically writes a JSON cache file that only the current user can read. Write errors are ignored."""
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # A unique temp file per write keeps concurrent runs from interleaving half-written files
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        except OSError:
+            return
+
+        try:
+            os.fchmod(fd, 0o600) # The token cache holds a live bearer credential
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _load_cached_token(self):
+        """Returns the token cached by a previous run if it belongs to these credentials and is still fresh."""
+        try:
+            with open(self.TOKEN_CACHE_FILE) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(cached, dict) or cached.get("client_id") != self.client_id:
+            return None
+        expires_at = cached.get("expires_at")
+        if not isinstance(expires_at, (int, float)) or time.time() >= expires_at - self.TOKEN_EXPIRY_MARGIN:
+            return None
+        return cached.get("access_token")
+
+    def _invalidate_cached_token(self):
+        """Removes the on-disk token so neither this nor a later run reuses it."""
+        try:
+            os.remove(self.TOKEN_CACHE_FILE)
+        except OSError:
+            pass
+
+    def _save_cached_token(self, token_data):
+        """Writes a freshly issued token and its expiry time to disk for reuse by later runs."""
+        if not token_data.get("access_token") or not token_data.get("expires_in"):
+            return
+
+        cached = {
+            "client_id": self.client_id,
+            "access_token": token_data["access_token"],
+            "expires_at": time.time() + int(token_data["expires_in"]),
+        }
+        self._write_cache_file(self.TOKEN_CACHE_FILE, cached)
+
+    def _load_airline_cache(self):
+        """Loads the on-disk airline cache as {code: (name, fetched_at)}, dropping entries older than AIRLINE_CACHE_TTL."""
+        try:
+            with open(self.AIRLINE_CACHE_FILE) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+
+        fresh = {}
+        now = time.time()
+        for code, entry in entries.items():
+            try:
+                if now - entry["fetched_at"] <= self.AIRLINE_CACHE_TTL:
+                    fresh[code] = (entry["name"], entry["fetched_at"])
+            except (KeyError, TypeError):
+                continue # Entry from an older cache format; refetch it
+        return fresh
+
+    def _save_airline_cache(self):
+        """Writes API-resolved airline names to disk with their fetch times. Codes that fell back to themselves are not persisted."""
+        if not self._airline_cache_dirty: return
+
+        self._airline_cache_dirty = False
+        entries = {
+            code: {"name": self.airline_cache[code], "fetched_at": fetched_at}
+            for code, fetched_at in self._airline_fetched_at.items()
+        }
+        self._write_cache_file(self.AIRLINE_CACHE_FILE, entries)
+
+    def _load_offer_cache(self):
+        """Loads live offers cached by recent runs, dropping the ones whose OFFER_CACHE_TTL has passed."""
+        try:
+            with open(self.OFFER_CACHE_FILE) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+
+        now = time.time()
+        fresh = {}
+        for key, entry in entries.items():
+            try:
+                expires_at, _ = entry
+                if expires_at > now:
+                    fresh[key] = entry
+            except (TypeError, ValueError):
+                continue # Not an [expires_at, raw offer] pair; drop it rather than the whole cache
+        return fresh
+
+    def _save_offer_cache(self):
+        """Writes unexpired cached offers to disk, keeping at most OFFER_CACHE_MAXSIZE of them."""
+        if not self._offer_cache_dirty: return
+
+        self._offer_cache_dirty = False
+        now = time.time()
+        live = [(key, entry) for key, entry in self.offer_cache.items() if entry[0] > now]
+        if len(live) > self.OFFER_CACHE_MAXSIZE:
+            live = heapq.nlargest(self.OFFER_CACHE_MAXSIZE, live, key=lambda item: item[1][0])
+        self._write_cache_file(self.OFFER_CACHE_FILE, dict(live))
+
+    def _remember_airline_name(self, carrier_code, airline_name):
+        """Caches a name returned by the API and stamps it so it expires AIRLINE_CACHE_TTL after this fetch."""
+        self.airline_cache[carrier_code] = airline_name
+        self._airline_fetched_at[carrier_code] = time.time()
+        self._airline_cache_dirty = True
+
     def _get_airline_name(self, carrier_code):
         """Fetches and caches an airline's name from its IATA code."""
-        if carrier_code in self.airline_cache:
-            return self.airline_cache[carrier_code]
+        if (airline_name := self.airline_cache.get(carrier_code)) is not None:
+            return airline_name
         
-        headers = {"Authorization": f"Bearer {self.token}"}
         params = {"airlineCodes": carrier_code}
         try:
-            response = requests.get(self.AIRLINES_URL, headers=headers, params=params)
+            response = self._api_get(self.AIRLINES_URL, params)
             response.raise_for_status()
-            data = response.json().get("data", [])
+            data = self._decode_json(response).get("data", [])
             if data:
                 airline_name = data[0].get("businessName", carrier_code)
-                self.airline_cache[carrier_code] = airline_name
+                self._remember_airline_name(carrier_code, airline_name)
                 return airline_name
         except requests.exceptions.RequestException:
             pass # Fail silently and just return the code
@@ -61,138 +318,209 @@ class FlightFinder:
         self.airline_cache[carrier_code] = carrier_code
         return carrier_code
     
-    def _parse_duration(self, iso_duration):
-        """Parses an ISO 8601 duration string (e.g., PT8H30M) into a readable format."""
-        if not iso_duration or 'P' not in iso_duration:
+    def _prefetch_airline_names(self, carrier_codes):
+        """Fetches the names of all uncached carriers in a single batched API call."""
+        missing_codes = set(carrier_codes) - self.airline_cache.keys()
+        if not missing_codes: return
+
+        params = {"airlineCodes": ",".join(sorted(missing_codes))}
+        try:
+            response = self._api_get(self.AIRLINES_URL, params)
+            response.raise_for_status()
+            for airline in self._decode_json(response).get("data", []):
+                code = airline.get("iataCode")
+                if code:
+                    self._remember_airline_name(code, airline.get("businessName", code))
+            # Codes the API doesn't know would otherwise cost one more request each; display them as-is
+            for code in missing_codes - self.airline_cache.keys():
+                self.airline_cache[code] = code
+        except requests.exceptions.RequestException:
+            pass # Fall back to per-code lookups in _get_airline_name
+
+    def _warm_airline_cache(self, offer):
+        """Resolves the names of every carrier flying an offer, so displaying it needs no further API calls."""
+        self._prefetch_airline_names(
+            segment['carrierCode'] for itinerary in offer.get("itineraries", []) for segment in itinerary.get("segments", [])
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _parse_duration(iso_duration):
+        """Parses an ISO 8601 duration string (e.g., PT8H30M) into a readable format, memoized per string."""
+        match = DURATION_RE.match(iso_duration or "")
+        if not match:
             return "N/A"
-        
-        # Remove the 'P' and 'T' designators
-        duration_str = iso_duration.replace("P", "").replace("T", "")
-        
-        hours, minutes = 0, 0
-        
-        if 'H' in duration_str:
-            h_split = duration_str.split('H')
-            hours = int(h_split[0])
-            duration_str = h_split[1]
-        
-        if 'M' in duration_str:
-            m_split = duration_str.split('M')
-            minutes = int(m_split[0])
-            
-        return f"{hours}h {minutes}m"
 
+        days, hours, minutes = (int(group or 0) for group in match.groups())
+        return f"{days * 24 + hours}h {minutes}m"
 
-    def _find_candidate_dates(self, origin, destination, search_window_days=180):
-        """STEP 1: Use the inspirational API to find the cheapest one-way departure dates."""
-        if not self.token: return []
 
-        print(f"\nSTEP 1: 🔍 Finding cheapest departure date candidates for {origin} -> {destination}...")
+    def _find_candidate_dates(self, origin, destination, search_window_days=180):
+        """STEP 1: Use the inspirational API to find the cheapest one-way departure dates as (price, date) pairs."""
+        logger.info(f"\nSTEP 1: 🔍 Finding cheapest departure date candidates for {origin} -> {destination}...")
         start_date = (datetime.date.today() + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
         end_date = (datetime.date.today() + datetime.timedelta(days=search_window_days)).strftime("%Y-%m-%d")
 
         params = { "origin": origin, "destination": destination, "departureDate": f"{start_date},{end_date}", "oneWay": "true", "nonStop": "false" }
-        headers = {"Authorization": f"Bearer {self.token}"}
-
         try:
-            response = requests.get(self.FLIGHT_DATES_URL, headers=headers, params=params)
+            response = self._api_get(self.FLIGHT_DATES_URL, params)
             if response.status_code == 404:
-                print("  ⚠️  Inspirational API returned 404. This route may not be in the cache.")
+                logger.warning("  ⚠️  Inspirational API returned 404. This route may not be in the cache.")
                 return []
             response.raise_for_status()
-            data = response.json().get("data", [])
-            print(f"  ✅ Found {len(data)} candidate dates.")
-            return data
+            data = self._decode_json(response).get("data", [])
+            logger.info(f"  ✅ Found {len(data)} candidate dates.")
+            # Only the price and date are used downstream; drop the rest of each record (links, return dates, ...)
+            candidates = []
+            for item in data:
+                try:
+                    candidates.append((float(item['price']['total']), item['departureDate']))
+                except (KeyError, TypeError, ValueError):
+                    continue # Skip malformed rows rather than abandoning the whole search
+            return candidates
         except requests.exceptions.RequestException as e:
-            print(f"  ❌ An error occurred in Step 1: {e}")
+            logger.error(f"  ❌ An error occurred in Step 1: {e}")
             return []
             
+    def _to_live_offer(self, raw):
+        """Flattens a raw flight offer into a LiveOffer, or returns None if it lacks the fields we rely on."""
+        try:
+            return LiveOffer(
+                price=float(raw['price']['total']),
+                connections=max(len(itinerary['segments']) - 1 for itinerary in raw['itineraries']),
+                raw=raw,
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
     def _get_live_offer(self, origin, destination, departure_date, min_days, max_days, max_connections):
-        """STEP 2 (Helper): Get a live, bookable flight offer for a specific date range."""
-        if not self.token: return None
-
-        avg_duration = int((min_days + max_days) / 2)
-        return_date_obj = datetime.datetime.strptime(departure_date, "%Y-%m-%d").date() + datetime.timedelta(days=avg_duration)
-        return_date = return_date_obj.strftime("%Y-%m-%d")
-
-        params = { 
-            "originLocationCode": origin, 
-            "destinationLocationCode": destination, 
-            "departureDate": departure_date, 
-            "returnDate": return_date, 
-            "adults": 1, 
-            "max": 5,
-            # "maxNumberOfConnections": max_connections -> this doesn't work. Shitty Amadeus API
+        """STEP 2 (Helper): Get the cheapest live, bookable flight offer for a specific date range as a LiveOffer."""
+        avg_duration = (min_days + max_days) // 2
+        return_date = (datetime.date.fromisoformat(departure_date) + datetime.timedelta(days=avg_duration)).isoformat()
+
+        cache_key = f"{origin}|{destination}|{departure_date}|{return_date}|{max_connections}"
+        cached = self.offer_cache.get(cache_key)
+        if cached and cached[0] > time.time():
+            return self._to_live_offer(cached[1]) if cached[1] else None
+
+        params = {
+            **self.OFFER_PARAMS_BASE,
+            "originLocationCode": origin,
+            "destinationLocationCode": destination,
+            "departureDate": departure_date,
+            "returnDate": return_date,
         }
-        headers = {"Authorization": f"Bearer {self.token}"}
+        if max_connections == 0:
+            params["nonStop"] = "true" # The one connection filter the API does honour
         
         try:
-            response = requests.get(self.FLIGHT_OFFERS_URL, headers=headers, params=params)
+            response = self._api_get(self.FLIGHT_OFFERS_URL, params)
             response.raise_for_status()
-            offers = response.json().get("data", [])
-            return offers[0] if offers else None
+            offers = [o for o in map(self._to_live_offer, self._decode_json(response).get("data", [])) if o]
+            # The API ignores maxNumberOfConnections, so enforce the limit on our side
+            eligible = [o for o in offers if o.connections <= max_connections]
+            if offers and not eligible:
+                # Flights exist, just none within the limit: report that rather than caching it as "no data"
+                self._connection_limited_dates.add(departure_date)
+                return None
+            offer = min(eligible, key=attrgetter("price")) if eligible else None
+            self.offer_cache[cache_key] = [time.time() + self.OFFER_CACHE_TTL, offer.raw if offer else None]
+            self._offer_cache_dirty = True
+            return offer
         except requests.exceptions.RequestException:
             return None
 
+    def _get_cheapest_live_offer(self, origin, destination, departure_dates, min_days, max_days, max_connections):
+        """STEP 2: Fetch live offers for all departure dates concurrently and keep the cheapest in a single pass."""
+        departure_dates = list(dict.fromkeys(departure_dates)) # Issue at most one request per date, keeping order
+        if not departure_dates: return None
+
+        cheapest_offer = None
+        with ThreadPoolExecutor(max_workers=min(self.MAX_PARALLEL_REQUESTS, len(departure_dates))) as executor:
+            futures = [
+                executor.submit(self._get_live_offer, origin, destination, departure_date, min_days, max_days, max_connections)
+                for departure_date in departure_dates
+            ]
+            # Fold each offer in as soon as its request finishes instead of waiting on submission order
+            for future in as_completed(futures):
+                offer = future.result()
+                if offer and (cheapest_offer is None or offer.price < cheapest_offer.price):
+                    cheapest_offer = offer
+        return cheapest_offer
+
     def find_cheapest_trip(self, origin, destination, min_days=25, max_days=30, max_connections=2, num_candidates=5):
         """Main method to find the cheapest trip using a hybrid strategy."""
-        if not self.token: return None
-
+        self._connection_limited_dates.clear()
         candidate_dates = self._find_candidate_dates(origin, destination)
-        live_offers = []
 
         if candidate_dates:
-            print(f"\nSTEP 2: ✈️  Getting live offers for the top {num_candidates} candidate dates...")
-            top_candidates = sorted(candidate_dates, key=lambda x: float(x['price']['total']))[:num_candidates]
-            for candidate in top_candidates:
-                offer = self._get_live_offer(origin, destination, candidate['departureDate'], min_days, max_days, max_connections)
-                if offer: live_offers.append(offer)
+            logger.info(f"\nSTEP 2: ✈️  Getting live offers for the top {num_candidates} candidate dates...")
+            top_candidates = heapq.nsmallest(num_candidates, candidate_dates)
+            departure_dates = [departure_date for _, departure_date in top_candidates]
         else:
-            print("\n  FALLBACK: Inspirational search failed. Probing live API directly...")
-            print(f"STEP 2: ✈️  Probing the first Tuesday of the next 3 months...")
+            logger.info("\n  FALLBACK: Inspirational search failed. Probing live API directly...")
+            logger.info("STEP 2: ✈️  Probing the first Tuesday of the next 3 months...")
             today = datetime.date.today()
+            departure_dates = []
             for i in range(1, 4):
-                first_of_month = (today.replace(day=1) + datetime.timedelta(days=31*i)).replace(day=1)
-                tuesday = first_of_month + datetime.timedelta(days=(1 - first_of_month.weekday() + 7) % 7)
-                offer = self._get_live_offer(origin, destination, tuesday.strftime("%Y-%m-%d"), min_days, max_days, max_connections)
-                if offer: live_offers.append(offer)
+                year_offset, month_index = divmod(today.month - 1 + i, 12)
+                first_of_month = datetime.date(today.year + year_offset, month_index + 1, 1)
+                # The first Tuesday (weekday 1) falls within the first seven days of the month
+                tuesday = first_of_month.replace(day=1 + (1 - first_of_month.weekday()) % 7)
+                departure_dates.append(tuesday.isoformat())
+
+        cheapest_offer = self._get_cheapest_live_offer(origin, destination, departure_dates, min_days, max_days, max_connections)
 
-        if not live_offers:
+        if not cheapest_offer and self._connection_limited_dates:
+            print(f"\n😕 Flights were found for {origin} -> {destination} on {len(self._connection_limited_dates)} date(s), "
+                  f"but every one needs more than {max_connections} connection(s). Try raising max_connections.")
+            return None
+        if not cheapest_offer:
             print(f"\n😕 No flight results found for {origin} -> {destination}. The test API may not have data for this itinerary.")
             return None
         
-        return min(live_offers, key=lambda x: float(x['price']['total']))
+        self._warm_airline_cache(cheapest_offer.raw)
+        return cheapest_offer.raw
 
     def display_results(self, offer, origin, destination):
         """Prints the final cheapest offer with full segment and airline details."""
         if not offer: return
 
+        # Walk the itineraries once, collecting their segments for printing and every carrier for the name lookup
+        segments_by_itinerary = []
+        carriers = set()
+        for itinerary in offer.get("itineraries", []):
+            segments = itinerary.get("segments", [])
+            segments_by_itinerary.append((itinerary, segments))
+            carriers.update(segment['carrierCode'] for segment in segments)
+
+        # No-op when find_cheapest_trip already warmed the cache; covers offers obtained elsewhere
+        self._prefetch_airline_names(carriers)
+
         print("\n" + "="*60)
         print("🏆 Overall Cheapest Trip Found! 🏆".center(60))
         print("="*60)
         
         price = offer.get("price", {})
-        itineraries = offer.get("itineraries", [])
         
         print(f"  Route: {origin} -> {destination}")
         print(f"  💰 Price: {price.get('total')} {price.get('currency')}")
         
-        # Extract and display dates
-        if itineraries:
-            outbound_segments = itineraries[0].get("segments", [])
-            inbound_segments = itineraries[1].get("segments", []) if len(itineraries) > 1 else []
+        # Extract and display dates (Amadeus timestamps are ISO 8601, so the date is the first 10 characters)
+        if segments_by_itinerary:
+            outbound_segments = segments_by_itinerary[0][1]
+            inbound_segments = segments_by_itinerary[1][1] if len(segments_by_itinerary) > 1 else []
             
             if outbound_segments:
-                departure_date = datetime.datetime.fromisoformat(outbound_segments[0]['departure']['at']).strftime('%Y-%m-%d')
+                departure_date = outbound_segments[0]['departure']['at'][:10]
                 print(f"  📅 Departure Date: {departure_date}")
             
             if inbound_segments:
-                return_date = datetime.datetime.fromisoformat(inbound_segments[-1]['arrival']['at']).strftime('%Y-%m-%d')
+                return_date = inbound_segments[-1]['arrival']['at'][:10]
                 print(f"  📅 Return Date: {return_date}")
         
-        for i, itinerary in enumerate(itineraries):
+        for i, (itinerary, segments) in enumerate(segments_by_itinerary):
             journey = "➡️  Outbound" if i == 0 else "⬅️  Inbound"
-            segments = itinerary.get("segments", [])
             if not segments: continue
 
             # Parse and display total duration
@@ -201,7 +529,7 @@ class FlightFinder:
 
             primary_airline = self._get_airline_name(segments[0]['carrierCode'])
             connections = len(segments) - 1
-            connection_text = "Direct" if connections == 0 else f"{connections} connection{'s' if connections > 1 else ''}"
+            connection_text = CONNECTION_TEXT[connections] if connections < len(CONNECTION_TEXT) else f"{connections} connections"
             
             print(f"\n  {journey} ({connection_text} | 🕒 Total Duration: {duration_formatted})")
             print(f"    ✈️  Airline: {primary_airline}")
@@ -213,8 +541,9 @@ class FlightFinder:
                 airline = self._get_airline_name(segment['carrierCode'])
                 flight_num = f"{segment['carrierCode']}{segment['number']}"
                 
-                dep_time = datetime.datetime.fromisoformat(dep['at']).strftime('%H:%M')
-                arr_time = datetime.datetime.fromisoformat(arr['at']).strftime('%H:%M')
+                # ISO 8601 'YYYY-MM-DDTHH:MM:SS' -> 'HH:MM'
+                dep_time = dep['at'][11:16]
+                arr_time = arr['at'][11:16]
                 
                 print(f"      {dep['iataCode']} ({dep_time}) → {arr['iataCode']} ({arr_time})  |  {flight_num} ({airline})")
 
@@ -223,24 +552,37 @@ class FlightFinder:
 
 def main():
     """Main function to run the flight finder."""
+    log_level = LOG_LEVEL if LOG_LEVEL in logging.getLevelNamesMapping() else "WARNING"
+    logging.basicConfig(level=log_level, format="%(message)s")
+    if log_level != LOG_LEVEL:
+        logger.warning(f"⚠️  Unknown log_level {LOG_LEVEL!r}; falling back to WARNING.")
+
     print("==========================================")
     print("   Amadeus Hybrid Flight Finder   ")
     print("==========================================")
     
-    ORIGIN = os.environ.get("origin", "BER")
-    DESTINATION = os.environ.get("destination", "PDX")
+    ORIGIN = os.environ.get("origin", "BER").strip().upper()
+    DESTINATION = os.environ.get("destination", "PDX").strip().upper()
     MIN_TRIP_DAYS = int(os.environ.get("min_trip_days", "25"))
     MAX_TRIP_DAYS = int(os.environ.get("max_trip_days", "30"))
     MAX_CONNECTIONS = int(os.environ.get("max_connections", "2"))
 
-    finder = FlightFinder(AMADEUS_CLIENT_ID, AMADEUS_CLIENT_SECRET)
-    if finder.token:
-        cheapest_trip = finder.find_cheapest_trip(
-            origin=ORIGIN, destination=DESTINATION,
-            min_days=MIN_TRIP_DAYS, max_days=MAX_TRIP_DAYS,
-            max_connections=MAX_CONNECTIONS
-        )
-        finder.display_results(cheapest_trip, ORIGIN, DESTINATION)
+    # Reject malformed codes locally instead of spending a token request and a search round trip on them
+    invalid_codes = [code for code in (ORIGIN, DESTINATION) if not IATA_CODE_RE.fullmatch(code)]
+    if invalid_codes:
+        sys.exit(f"❌ ERROR: Invalid IATA code(s): {', '.join(repr(code) for code in invalid_codes)}")
+
+    try:
+        finder = FlightFinder(AMADEUS_CLIENT_ID, AMADEUS_CLIENT_SECRET)
+    except FlightFinderUnauthorized as e:
+        sys.exit(f"❌ ERROR: {e}") # _get_token has already logged the underlying cause
+
+    cheapest_trip = finder.find_cheapest_trip(
+        origin=ORIGIN, destination=DESTINATION,
+        min_days=MIN_TRIP_DAYS, max_days=MAX_TRIP_DAYS,
+        max_connections=MAX_CONNECTIONS
+    )
+    finder.display_results(cheapest_trip, ORIGIN, DESTINATION)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file